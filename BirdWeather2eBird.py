@@ -16,20 +16,149 @@ You may not:
 
 All rights are reserved by the author.
 """
+import contextlib
 import csv
 import os
 import sys
+from collections import Counter
 from datetime import datetime
 
 from conf import config
+from lib import cache_support
 from lib import core_processing
 from lib import cli_support
+from lib import output_support
+from lib import shape_bundle
+from lib import stats_processing
+
+def build_shape_bundles(logger, args):
+    """
+    Builds the configured country and state shape bundles from the configured shape files.
+
+    When a simplification tolerance is configured, the station locations from the input file are used
+    to verify that the simplified shapes return the same codes around each station. Exits if the input
+    file has no station locations to verify against.
+
+    Args:
+        logger (logging.Logger): Logger for emitting error/info messages.
+        args (Namespace): Parsed command-line arguments, containing `input_file`.
+
+    Returns:
+        None
+    """
+    station_locations = set()
+    if os.path.exists(args.input_file):
+        with open(args.input_file, newline="", encoding="utf-8") as infile:
+            for row in csv.DictReader(infile):
+                station_locations.add((row["Latitude"], row["Longitude"]))
+    if config.shape_bundle_tolerance and not station_locations:
+        logger.error('No station locations found in the input file to verify the simplified shapes against, '
+                     'provide an input file with -i or set shape_bundle_tolerance to 0')
+        sys.exit()
+    check_areas = shape_bundle.get_check_areas(station_locations, config.shape_bundle_check_radius)
+
+    for bundle_path, shape_file, code_field in [
+        (config.country_shape_bundle, config.country_shape_file, 'ISO_A2'),
+        (config.state_shape_bundle, config.state_shape_file, 'STUSPS')
+    ]:
+        if not bundle_path:
+            logger.warning(f'No shape bundle path configured for {shape_file}, skipping')
+            continue
+        shapes = core_processing.load_shapes(shape_file, code_field)
+        if config.shape_bundle_tolerance:
+            shapes, kept_count = shape_bundle.simplify_shapes(shapes, config.shape_bundle_tolerance, check_areas)
+            logger.info(f'{kept_count} shape(s) kept at full resolution to preserve codes near station locations')
+        shape_bundle.build_bundle(shapes, bundle_path, shape_file, code_field, config.shape_bundle_tolerance,
+                                  station_locations, config.shape_bundle_check_radius)
+        logger.info(f'Built shape bundle {bundle_path} from {shape_file} ({len(shapes)} shapes)')
+
+def get_conversion_options(args):
+    """
+    Gets every option that affects the content of the output files, for use in the conversion cache key.
+
+    Args:
+        args (Namespace): Parsed command-line arguments.
+
+    Returns:
+        dict: The effective conversion options
+    """
+    return {
+        "checklist": args.checklist,
+        "state_code": args.state_code,
+        "country_code": args.country_code,
+        "protocol": args.protocol,
+        "number_of_observers": args.number_of_observers,
+        "comments": args.comments or config.checklist_comments,
+        "filter_to_date": args.filter_to_date,
+        "max_rows": args.max_rows,
+        "max_bytes": args.max_bytes,
+        "max_checklists": args.max_checklists,
+        "species_comments": config.SPECIES_COMMENTS,
+        "duration": config.DURATION,
+        "all_obs_reported": config.ALL_OBS_REPORTED,
+        "distance_covered": config.DISTANCE_COVERED,
+        "area_covered": config.AREA_COVERED,
+        # Updating a shapefile or rebuilding a bundle can change the state and country codes
+        "shape_files": {
+            path: cache_support.get_file_signature(path)
+            for shape_file in [config.country_shape_file, config.state_shape_file]
+            for path in [shape_file, f"{os.path.splitext(shape_file)[0]}.dbf"]
+        },
+        "shape_bundles": {
+            path: cache_support.get_file_signature(path)
+            for path in [config.country_shape_bundle, config.state_shape_bundle]
+        },
+        "shape_bundle_tolerance": config.shape_bundle_tolerance
+    }
+
+def report_stats(logger, args, summary, cache_status):
+    """
+    Writes the stats summary to --stats_json and outputs it to the logger with --stats, if set.
+
+    Args:
+        logger (logging.Logger): Logger for emitting stats.
+        args (Namespace): Parsed command-line arguments, containing `stats` and `stats_json`.
+        summary (dict): Stats summary of the conversion, from stats_processing.build_summary().
+        cache_status (str): Whether the conversion was reused from the conversion cache, being "hit", "miss"
+            or "disabled".
+
+    Returns:
+        None
+    """
+    if args.stats_json:
+        stats_processing.write_summary(summary, args.stats_json)
+        logger.debug(f'Stats File: {args.stats_json}')
+    if args.stats:
+        stats_processing.log_summary(logger, summary)
+        logger.info(f'Conversion Cache: {cache_status}')
+        logger.info('')
 
 def main():
     args = cli_support.input_argparse()
     logger = cli_support.start_logging(config.log_file_path, args.log_level, config.tool_name)
 
     logger.info('Running BirdWeather2eBird')
+    if args.build_shape_bundles:
+        build_shape_bundles(logger, args)
+        logger.info('BirdWeather2eBird ran Successfully!')
+        return
+    if args.merge_stats:
+        if not args.stats_json:
+            logger.error('--merge_stats requires --stats_json to be set to the merged output path')
+            sys.exit()
+        summaries = [stats_processing.read_summary(stats_file) for stats_file in args.merge_stats]
+        try:
+            summary = stats_processing.merge_summaries(summaries)
+        except ValueError as error:
+            logger.error(f'Unable to merge stats files: {error}')
+            sys.exit()
+        stats_processing.write_summary(summary, args.stats_json)
+        logger.info(f'Merged stats of {summary["runs"]} run(s) from {len(args.merge_stats)} stats file(s) '
+                    f'into {args.stats_json}')
+        if args.stats:
+            stats_processing.log_summary(logger, summary)
+        logger.info('BirdWeather2eBird ran Successfully!')
+        return
     logger.debug(f'Input File: {args.input_file}')
     logger.debug(f'Output File: {args.output_file}')
 
@@ -46,19 +175,44 @@ def main():
     else:
         output_file = os.path.join(config.output_path,
                                    core_processing.generate_filename("BirdWeather2eBird", file_date))
+
+    # Skip the conversion if the same input was already converted with the same options
+    use_cache = bool(config.cache_path) and not args.no_cache
+    input_hash = cache_support.get_input_hash(args.input_file)
+    cache_key = cache_support.get_cache_key(input_hash, get_conversion_options(args))
+    source_id = stats_processing.get_source_id(input_hash, args.filter_to_date)
+    if use_cache and not args.force:
+        cached_conversion = cache_support.restore_conversion(cache_key, output_file,
+                                                             reuse_outputs=not args.output_file)
+        if cached_conversion:
+            output_files, summary = cached_conversion
+            # Summaries cached by older versions don't record their source
+            summary.setdefault("sources", [source_id])
+            logger.info(f'Input was already converted with the same options, reusing output: {output_files}')
+            report_stats(logger, args, summary, cache_status="hit")
+            logger.info('BirdWeather2eBird ran Successfully!')
+            return
     
     unique_dates = [] # This is used to help determine if detections spanning multiple dates are included
     species_counts = {} # Stats: Dict to track count per species
     total_detections = 0 # Stats: Total count of all detections
+    species_hour_counts = Counter() # Stats: Count per (species, hour of day)
+    species_date_counts = Counter() # Stats: Count per (species, YYYY-MM-DD date)
     detection_firstlast = {
         "first_detection": None,
         "last_detection": None
     }
+    output_files = [] # Paths of every output file written
+    detections = [] # Checklist: (datetime, (common_name, scientific_name)) of each detection, for block counts
 
-    with open(args.input_file, newline="", encoding="utf-8") as infile, \
-        open(output_file, "w", newline="", encoding="utf-8") as outfile:
+    # The checklist output files are written after the detections have been counted, so only the record output is
+    # written during this first pass
+    if args.checklist:
+        record_writer = contextlib.nullcontext()
+    else:
+        record_writer = output_support.ShardedCsvWriter(output_file, args.max_rows, args.max_bytes)
+    with open(args.input_file, newline="", encoding="utf-8") as infile, record_writer as writer:
         reader = csv.DictReader(infile)
-        writer = csv.writer(outfile, lineterminator="\n")
         for row in reader:
             date, time = core_processing.parse_timestamp(row["Timestamp"])
             current_datetime = datetime.strptime(row["Timestamp"][:-6], "%Y-%m-%d %H:%M:%S")
@@ -113,65 +267,79 @@ def main():
                     checklist_comments              # Checklist Comments
                 ])
 
+            if args.checklist:
+                detections.append((current_datetime, (common_name, scientific_name)))
+
             total_detections += 1
             species_counts[(common_name, scientific_name)] = species_counts.get((common_name, scientific_name), 0) + 1
+            species_hour_counts[((common_name, scientific_name), current_datetime.hour)] += 1
+            species_date_counts[((common_name, scientific_name), current_datetime.date().isoformat())] += 1
     if len(unique_dates) > 1:
         logger.warning(f"Multiple dates found in input: {unique_dates}")
+    if not args.checklist:
+        output_files.extend(writer.output_files)
+        if len(writer.output_files) > 1:
+            logger.info(f'Output split into {len(writer.output_files)} files: {writer.output_files}')
 
     if args.checklist:
         # Get time blocks:
         if (detection_firstlast["first_detection"] is None) and (detection_firstlast["last_detection"] is None):
             logger.error(f"Input file did not contain any matches within specified --filter_to_date")
             sys.exit()
-        time_blocks = core_processing.split_time_range(detection_firstlast["first_detection"],
-                                                       detection_firstlast["last_detection"],
-                                                       core_processing.parse_time_period(args.checklist))
-        # Generate a list of block names
-        block_names = ["",""]
-        block_latitudes = ["Latitude",""]
-        block_longitudes = ["Longitude",""]
-        block_dates = ["Date",""]
-        block_start_times = ["Start Time",""]
-        block_states = ["State",""]
-        block_countries = ["Country",""]
-        block_protocols = ["Protocol",""]
-        block_num_obs = ["Num Observers",""]
-        block_durations = ["Duration (min)",""]
-        block_all_obs_reported = ["All Obs Reported (Y/N)",""]
-        block_dist_traveled = ["Dist Traveled (Miles)",""]
-        block_area_covered = ["Area Covered (Acres)",""]
-        block_notes = ["Notes",""]
+        # The intervals are ordered from finest to coarsest and validated by cli_support.input_argparse()
+        checklist_intervals = args.checklist
+        finest_interval = core_processing.parse_time_period(checklist_intervals[0])
         if args.comments:
             checklist_comments = args.comments
         else:
             checklist_comments = config.checklist_comments
 
-        checklist_duration = core_processing.get_duration(args.checklist)
-        block_count = 0
-        # This list will contain all of the different block's species counts, which are also lists
-        species_counts_by_block = []
-        # Iterate over our time blocks so that we create separate checklist entries for each block
-        for block_time in time_blocks:
-            with open(args.input_file, newline="", encoding="utf-8") as infile:
-                reader = csv.DictReader(infile)
-                block_count += 1
-                block_contains_detection = False
-                # Because the species count information is a bit more dynamic and is a list of lists, we build and
-                # append it to its list by iterating over each row in the input CSV and filtering to the specific time
-                # block.
-                block_species_counts = {(common_name, scientific_name): None for (common_name, scientific_name) in
-                                        species_counts}
-                for row in reader:
-                    current_datetime = datetime.strptime(row["Timestamp"][:-6], "%Y-%m-%d %H:%M:%S")
-                    # if start <= current <= end
-                    if block_time[0] <= current_datetime <= block_time[1]:
-                        block_contains_detection = True
-                        scientific_name = row["Scientific Name"].strip()
-                        common_name = row["Common Name"].strip()
-                        species_tuple = (common_name, scientific_name)
-                        block_species_counts[species_tuple] = ((block_species_counts.get(species_tuple) or 0) + 1)
-
-                if block_contains_detection:
+        # The finest time blocks are counted from the detections once, every coarser interval is rolled up from them
+        detections.sort()
+        fine_time_blocks = core_processing.split_time_range(detection_firstlast["first_detection"],
+                                                            detection_firstlast["last_detection"],
+                                                            finest_interval)
+        fine_block_counts, fine_block_end_counts = core_processing.count_detections_by_block(detections,
+                                                                                             fine_time_blocks)
+        for checklist_interval in checklist_intervals:
+            if checklist_interval == checklist_intervals[0]:
+                time_blocks = fine_time_blocks
+                block_counts = fine_block_counts
+            else:
+                time_blocks = core_processing.split_time_range(detection_firstlast["first_detection"],
+                                                               detection_firstlast["last_detection"],
+                                                               core_processing.parse_time_period(checklist_interval))
+                block_counts = core_processing.roll_up_block_counts(fine_time_blocks, fine_block_counts,
+                                                                    fine_block_end_counts, time_blocks)
+            # Each interval gets its own output file when more than one interval was requested
+            if len(checklist_intervals) > 1:
+                checklist_output_file = core_processing.add_filename_suffix(
+                    output_file, f"-{checklist_interval[0]}{checklist_interval[1]}")
+            else:
+                checklist_output_file = output_file
+
+            # Generate a list of block names
+            block_names = ["",""]
+            block_latitudes = ["Latitude",""]
+            block_longitudes = ["Longitude",""]
+            block_dates = ["Date",""]
+            block_start_times = ["Start Time",""]
+            block_states = ["State",""]
+            block_countries = ["Country",""]
+            block_protocols = ["Protocol",""]
+            block_num_obs = ["Num Observers",""]
+            block_durations = ["Duration (min)",""]
+            block_all_obs_reported = ["All Obs Reported (Y/N)",""]
+            block_dist_traveled = ["Dist Traveled (Miles)",""]
+            block_area_covered = ["Area Covered (Acres)",""]
+            block_notes = ["Notes",""]
+
+            checklist_duration = core_processing.get_duration(checklist_interval)
+            # This list will contain all of the different block's species counts
+            species_counts_by_block = []
+            # Iterate over our time blocks so that we create separate checklist entries for each block
+            for block_time, block_species_counts in zip(time_blocks, block_counts):
+                if block_species_counts:
                     # Append the station specific information to each time block entry in their respective lists
                     block_names.append(f'{station_details["station_name"]}-' \
                                         f'{core_processing.format_time_block(block_time)}')
@@ -193,40 +361,43 @@ def main():
                 else:
                     logger.info(f"Time block ({block_time[0]} - {block_time[1]}) contained no detections, skipping")
 
-        # Write the final output into the eBird Checklist Format, as a .csv
-        with open(output_file, "w", newline="", encoding="utf-8") as outfile:
-            writer = csv.writer(outfile, lineterminator="\n")
-            writer.writerow([*block_names])
-            writer.writerow([*block_latitudes])
-            writer.writerow([*block_longitudes])
-            writer.writerow([*block_dates])
-            writer.writerow([*block_start_times])
-            writer.writerow([*block_states])
-            writer.writerow([*block_countries])
-            writer.writerow([*block_protocols])
-            writer.writerow([*block_num_obs])
-            writer.writerow([*block_durations])
-            writer.writerow([*block_all_obs_reported])
-            writer.writerow([*block_dist_traveled])
-            writer.writerow([*block_area_covered])
-            writer.writerow([*block_notes])
-            # This unpacks our nested species lists and ensures that they are written properly in the output with their
-            # common name and species name (*species_key) as the first two columns of each row, followed by the totals
-            # for each time block.
+            # Write the final output into the eBird Checklist Format, as a .csv
+            logger.debug(f'Checklist Output File: {checklist_output_file}')
+            checklist_rows = [
+                block_names,
+                block_latitudes,
+                block_longitudes,
+                block_dates,
+                block_start_times,
+                block_states,
+                block_countries,
+                block_protocols,
+                block_num_obs,
+                block_durations,
+                block_all_obs_reported,
+                block_dist_traveled,
+                block_area_covered,
+                block_notes
+            ]
+            # This unpacks our species counts and ensures that they are written properly in the output with their
+            # common name and species name (*species_key) as the first two columns of each row, followed by the
+            # totals for each time block. Species without detections in a block are left blank.
             for species_key in species_counts:
-                row = [block.get(species_key, 0) for block in species_counts_by_block]
-                writer.writerow([*species_key, *row])
+                row = [block.get(species_key) or "" for block in species_counts_by_block]
+                checklist_rows.append([*species_key, *row])
+            checklist_output_files = output_support.write_checklist(checklist_output_file, checklist_rows,
+                                                                    args.max_checklists, args.max_bytes)
+            output_files.extend(checklist_output_files)
+            if len(checklist_output_files) > 1:
+                logger.info(f'Checklist output split into {len(checklist_output_files)} files: '
+                            f'{checklist_output_files}')
 
-    if args.stats:
-        logger.info('')
-        logger.info('Processed File Stats')
-        logger.info(f'Total Detections: {total_detections}')
-        logger.info(f'Total Species: {len(species_counts)}')
-        logger.info('')
-        logger.info('Species Stats')
-        for species, count in species_counts.items():
-            logger.info(f'{species}: {count}')
-        logger.info('')
+    summary = stats_processing.build_summary(total_detections, species_counts,
+                                             species_hour_counts, species_date_counts,
+                                             [source_id])
+    if use_cache:
+        cache_support.store_conversion(cache_key, output_file, output_files, summary)
+    report_stats(logger, args, summary, cache_status="miss" if use_cache else "disabled")
 
     logger.info('BirdWeather2eBird ran Successfully!')
 
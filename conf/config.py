@@ -12,7 +12,20 @@ checklist_comments = ""
 
 country_shape_file = ""
 state_shape_file = ""
+# Precompiled shape bundles (see --build_shape_bundles), used instead of the shape files above when they exist
+country_shape_bundle = ""
+state_shape_bundle = ""
+# Simplification tolerance (degrees) used when building shape bundles, 0 keeps the full resolution
+shape_bundle_tolerance = 0.0
+# Distance (degrees) around each station location that is checked to keep the same codes after simplification
+shape_bundle_check_radius = 0.1
 
 tool_name = "BirdWeather2eBird"
+tool_version = "1.0.0"
+# Directory holding the conversion cache, used to skip converting the same input with the same options again.
+# Leave blank to disable the conversion cache
+cache_path = "BirdWeather2eBird_cache"
+# Cache entries not used for this many days are removed, 0 keeps them forever
+cache_max_age_days = 30
 log_file_path = "BirdWeather2eBird.log"
 log_level = "INFO"
@@ -0,0 +1,273 @@
+"""
+cache_support.py
+
+This library provides a conversion cache for BirdWeather2eBird, so that converting the same input
+with the same options again reuses the previous output instead of redoing the conversion.
+
+Conversions are keyed by a hash of the input file content, the effective options and the tool version.
+Each cache entry holds read-only copies of the output files, along with a manifest containing the paths
+they were written to, the SHA-256 of each file and the stats summary of the conversion. Cached files are
+verified against their SHA-256 before being reused, and are hard linked (or copied) to the output paths.
+Entries not used for config.cache_max_age_days are removed whenever a conversion is stored.
+
+It includes functions to:
+- get_input_hash(): Get the SHA-256 of an input file's content
+- get_cache_key(): Build the cache key of a conversion
+- get_file_signature(): Get the modification time and size of a file that affects the conversion
+- prune_cache(): Remove cache entries that were not used recently
+- store_conversion(): Store the output files and stats summary of a conversion in the cache
+- restore_conversion(): Reuse the output files and stats summary of a cached conversion
+
+Example usage:
+    from lib import cache_support
+
+Author: Spike Graham
+Copyright (c) 2025 Spike Graham
+All rights reserved.
+
+This software is provided for personal, non-commercial use only.  
+You may view and run this software for personal educational or non-profit purposes.
+
+You may not:
+- Use this software in any commercial or enterprise context.
+- Distribute modified or unmodified versions.
+- Sell or include this software as part of a paid or monetized service or product.
+- Use this software in any for-profit capacity.
+
+All rights are reserved by the author.
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import stat
+import time
+
+from conf import config
+from lib import core_processing
+from lib import output_support
+
+MANIFEST_FILE = "manifest.json"
+
+def get_input_hash(input_file):
+    """
+    Gets the SHA-256 of an input file's content, which identifies the input of a conversion
+
+    Args:
+        input_file (str): Path to the input .csv file
+
+    Returns:
+        str: Hex digest of the input file content
+    """
+    return get_file_hash(input_file)
+
+def get_cache_key(input_hash, options):
+    """
+    Builds the cache key of a conversion from the hash of the input file content, the effective options
+    and the tool version
+
+    Args:
+        input_hash (str): Hash of the input file content, from get_input_hash()
+        options (dict): Every option that affects the content of the output files
+
+    Returns:
+        str: Hex digest identifying the conversion
+    """
+    digest = hashlib.sha256(input_hash.encode("utf-8"))
+    digest.update(json.dumps(options, sort_keys=True, default=str).encode("utf-8"))
+    digest.update(config.tool_version.encode("utf-8"))
+    return digest.hexdigest()
+
+def get_output_suffix(output_file, path):
+    """
+    Gets the suffix that was added to the output file path to build one of its output paths
+
+    Args:
+        output_file (str): Output file path (e.g., 'ebird_upload.csv')
+        path (str): Path of a file built from the output file path (e.g., 'ebird_upload-1h-001.csv')
+
+    Returns:
+        str: The added suffix (e.g., '-1h-001')
+    """
+    return os.path.splitext(path)[0][len(os.path.splitext(output_file)[0]):]
+
+def get_file_signature(path):
+    """
+    Gets the modification time and size of a file, used to include files that affect the conversion
+    (i.e. shapefiles) in the cache key
+
+    Args:
+        path (str): File path
+
+    Returns:
+        List[int]: [modification time in ns, size in bytes], or None if the file does not exist
+    """
+    if not path or not os.path.exists(path):
+        return None
+    stat_result = os.stat(path)
+    return [stat_result.st_mtime_ns, stat_result.st_size]
+
+def get_file_hash(path):
+    """
+    Gets the SHA-256 of a file's content
+
+    Args:
+        path (str): File path
+
+    Returns:
+        str: Hex digest of the file content
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as infile:
+        for chunk in iter(lambda: infile.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def remove_entry(entry_path):
+    """
+    Removes a cache entry, including its read-only cached files
+
+    Args:
+        entry_path (str): Path to the cache entry directory
+
+    Returns:
+        None
+    """
+    for name in os.listdir(entry_path):
+        output_support.remove_file(os.path.join(entry_path, name))
+    os.rmdir(entry_path)
+
+def link_file(source, destination):
+    """
+    Hard links a cached file to destination, replacing any existing destination file. Falls back to copying
+    the file when a hard link can't be created, i.e. across file systems.
+
+    Args:
+        source (str): Cached file path
+        destination (str): Path to link the file to
+
+    Returns:
+        None
+    """
+    if os.path.exists(destination):
+        if os.path.samefile(source, destination):
+            return
+        output_support.remove_file(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+def prune_cache():
+    """
+    Removes the cache entries that were not stored or reused within config.cache_max_age_days. Entries
+    without a manifest (i.e. left by an interrupted run) are aged by their directory instead.
+
+    Returns:
+        None
+    """
+    if not config.cache_max_age_days or not os.path.isdir(config.cache_path):
+        return
+    oldest_time = time.time() - config.cache_max_age_days * 24 * 60 * 60
+    for cache_key in os.listdir(config.cache_path):
+        entry_path = os.path.join(config.cache_path, cache_key)
+        manifest_path = os.path.join(entry_path, MANIFEST_FILE)
+        last_used_path = manifest_path if os.path.exists(manifest_path) else entry_path
+        if os.path.isdir(entry_path) and os.path.getmtime(last_used_path) < oldest_time:
+            remove_entry(entry_path)
+
+def store_conversion(cache_key, output_file, output_files, summary):
+    """
+    Stores read-only copies of the output files and the stats summary of a conversion in the cache.
+    The files are copied rather than linked, so later edits to the output files do not alter the cache.
+    Cache entries that were not used recently are removed first.
+
+    Args:
+        cache_key (str): Cache key from get_cache_key()
+        output_file (str): Output file path the output files were built from
+        output_files (List[str]): Paths of the output files written by the conversion
+        summary (dict): Stats summary of the conversion, from stats_processing.build_summary()
+
+    Returns:
+        None
+    """
+    prune_cache()
+    entry_path = os.path.join(config.cache_path, cache_key)
+    if os.path.exists(entry_path):
+        remove_entry(entry_path)
+    os.makedirs(entry_path)
+    outputs = []
+    for index, path in enumerate(output_files):
+        cached_file = f"{index}.csv"
+        cached_path = os.path.join(entry_path, cached_file)
+        shutil.copyfile(path, cached_path)
+        os.chmod(cached_path, os.stat(cached_path).st_mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+        outputs.append({
+            "path": os.path.abspath(path),
+            "suffix": get_output_suffix(output_file, path),
+            "cached_file": cached_file,
+            "sha256": get_file_hash(cached_path)
+        })
+    # The manifest is written last, so an entry is only used once all of its files are in place
+    manifest_path = os.path.join(entry_path, MANIFEST_FILE)
+    with open(f"{manifest_path}.tmp", "w", encoding="utf-8") as manifest_file:
+        json.dump({"outputs": outputs, "summary": summary}, manifest_file)
+    os.replace(f"{manifest_path}.tmp", manifest_path)
+
+def restore_conversion(cache_key, output_file, reuse_outputs):
+    """
+    Reuses the output files and stats summary of a cached conversion, if one exists. Every cached file
+    is checked against its recorded SHA-256 first; if any of them changed, the entry is removed and the
+    conversion is treated as not cached.
+
+    When reuse_outputs is set and the previous output files all still exist with the cached content, they
+    are returned as is. Otherwise any output left by a previous run at the paths built from output_file is
+    removed, as a new conversion would, and the cached files are hard linked to those paths.
+
+    Args:
+        cache_key (str): Cache key from get_cache_key()
+        output_file (str): Output file path requested for this conversion
+        reuse_outputs (bool): Whether the previous output files may be reused instead of output_file,
+            i.e. when the output file name was generated rather than provided
+
+    Returns:
+        Tuple containing (output_files, summary), or None if the conversion is not cached
+    """
+    entry_path = os.path.join(config.cache_path, cache_key)
+    manifest_path = os.path.join(entry_path, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, encoding="utf-8") as manifest_file:
+        manifest = json.load(manifest_file)
+
+    outputs = manifest["outputs"]
+    cached_files = [os.path.join(entry_path, output["cached_file"]) for output in outputs]
+    if not all(os.path.exists(cached_file) and get_file_hash(cached_file) == output["sha256"]
+               for output, cached_file in zip(outputs, cached_files)):
+        remove_entry(entry_path)
+        return None
+    # Reusing an entry counts as using it, so it is not pruned while still in use
+    os.utime(manifest_path)
+    if reuse_outputs and all(os.path.exists(output["path"]) and get_file_hash(output["path"]) == output["sha256"]
+                             for output in outputs):
+        return [output["path"] for output in outputs], manifest["summary"]
+
+    # Group the outputs by the output file they were built from, shards being numbered -001, -002, ... after it
+    shard_files = {}
+    for output in outputs:
+        base_file = core_processing.add_filename_suffix(output_file, re.sub(r"-\d{3}$", "", output["suffix"]))
+        shard_files.setdefault(base_file, []).append(core_processing.add_filename_suffix(output_file,
+                                                                                         output["suffix"]))
+    for base_file, paths in shard_files.items():
+        sharded = paths != [base_file]
+        output_support.remove_previous_output(base_file, sharded)
+        if sharded:
+            output_support.write_shard_list(base_file, paths)
+
+    output_files = []
+    for output, cached_file in zip(outputs, cached_files):
+        path = core_processing.add_filename_suffix(output_file, output["suffix"])
+        link_file(cached_file, path)
+        output_files.append(path)
+    return output_files, manifest["summary"]
@@ -7,6 +7,8 @@ with BirdWeather2eBird.
 It includes functions to:
 - start_logging(): Configure and start CLI based logging
 - input_argparse(): Parse CLI input arguments
+- validate_checklist_intervals(): Validate and order the --checklist intervals
+- parse_positive_int_input(): Parse a positive integer CLI input
 
 Example usage:
     from lib import cli_support
@@ -32,6 +34,7 @@ import logging
 import re
 
 from conf import config
+from lib import core_processing
 
 def start_logging(log_path, log_level, logger_name):
     """
@@ -99,11 +102,34 @@ def input_argparse():
     parser.add_argument(
         "--checklist",
         type=parse_time_period_input,
+        nargs="+",
         metavar='N[s|m|h|D]',
         help="Outputs as eBird Checklist Format (Grid) instead of eBird Record Format, using the input time interval."\
-             " Recommended: 1h for data from a 24/7/365 monitoring station",
+             " Recommended: 1h for data from a 24/7/365 monitoring station. Multiple intervals (i.e. 15m 1h 1D) may"\
+             " be provided, each coarser interval must be a multiple of the finest one and is written to its own file",
         required=False,
     )
+    parser.add_argument(
+        "--max_rows",
+        type=parse_positive_int_input,
+        metavar="INT",
+        help="Splits eBird Record Format output into numbered files of at most this many rows",
+        required=False
+    )
+    parser.add_argument(
+        "--max_bytes",
+        type=parse_positive_int_input,
+        metavar="INT",
+        help="Splits output into numbered files of at most this many bytes, each a valid eBird file",
+        required=False
+    )
+    parser.add_argument(
+        "--max_checklists",
+        type=parse_positive_int_input,
+        metavar="INT",
+        help="Splits eBird Checklist Format output into numbered files of at most this many checklists (columns)",
+        required=False
+    )
     parser.add_argument(
         "--state_code",
         type=str,
@@ -154,12 +180,104 @@ def input_argparse():
         help="Set the log level to run the application at",
         default=config.log_level
     )
+    parser.add_argument(
+        "--build_shape_bundles",
+        action='store_true',
+        help="Builds the configured country_shape_bundle and state_shape_bundle from the configured shape files "\
+             "and exits. The station locations in the input file are used to verify that simplification "\
+             "(shape_bundle_tolerance) does not change their codes"
+    )
     parser.add_argument(
         "--stats",
         action='store_true',
         help="Outputs stats about the processed data"
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "--force",
+        action='store_true',
+        help="Redoes the conversion even if the same input was already converted with the same options"
+    )
+    parser.add_argument(
+        "--no_cache",
+        action='store_true',
+        help="Neither reuses nor stores the output in the conversion cache"
+    )
+    parser.add_argument(
+        "--stats_json",
+        type=str,
+        metavar="PATH",
+        help="Writes stats about the processed data (per species totals, hour of day and date counts) "\
+             "to the specified .json file",
+        required=False
+    )
+    parser.add_argument(
+        "--merge_stats",
+        type=str,
+        nargs="+",
+        metavar="PATH",
+        help="Merges the specified --stats_json files into the file set by --stats_json and exits, "\
+             "without processing an input file. Each input file is only counted once, even if it "\
+             "was converted by several runs",
+        required=False
+    )
+    args = parser.parse_args()
+    if args.checklist:
+        args.checklist = validate_checklist_intervals(parser, args.checklist)
+    # Output limits only apply to the output format they split
+    if args.checklist and args.max_rows:
+        parser.error("--max_rows only applies to eBird Record Format output, use --max_checklists with --checklist")
+    if not args.checklist and args.max_checklists:
+        parser.error("--max_checklists only applies to eBird Checklist Format output, use it with --checklist")
+    return args
+
+def validate_checklist_intervals(parser, intervals):
+    """
+    Validates the --checklist intervals, exiting through parser.error() if they are invalid. Each
+    interval must be longer than 0, and every coarser interval must be a multiple of the finest one
+    so that it can be rolled up from the finest time blocks.
+
+    Args:
+        parser (argparse.ArgumentParser): Parser used to report errors
+        intervals (list[tuple[int, str]]): Parsed --checklist intervals
+
+    Returns:
+        list[tuple[int, str]]: The intervals ordered from finest to coarsest, with repeated intervals dropped
+    """
+    ordered_intervals = sorted(set(intervals), key=core_processing.parse_time_period)
+    finest_amount, finest_unit = ordered_intervals[0]
+    finest_interval = core_processing.parse_time_period(ordered_intervals[0])
+    if not finest_interval:
+        parser.error(f"Checklist interval {finest_amount}{finest_unit} must be longer than 0")
+    for previous, (amount, unit) in zip(ordered_intervals, ordered_intervals[1:]):
+        interval = core_processing.parse_time_period((amount, unit))
+        if interval == core_processing.parse_time_period(previous):
+            parser.error(f"Checklist intervals {previous[0]}{previous[1]} and {amount}{unit} are the same length, "
+                         "only provide one of them")
+        if interval % finest_interval:
+            parser.error(f"Checklist interval {amount}{unit} is not a multiple of the finest checklist interval "
+                         f"{finest_amount}{finest_unit}")
+    return ordered_intervals
+
+def parse_positive_int_input(value):
+    """
+    Parses a positive integer, i.e. an output limit
+
+    Args:
+        value (str): The integer string
+
+    Returns:
+        int: The parsed integer
+
+    Raises:
+        argparse.ArgumentTypeError: If the value is not an integer greater than 0
+    """
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"Invalid value: '{value}'. Expected an integer greater than 0.")
+    return number
 
 def parse_time_period_input(value):
     """
@@ -7,6 +7,9 @@ BirdWeather2eBird.
 It includes functions to:
 - parse_timestamp(): Parse and convert the timestamps provided by BirdWeather to be compatible with eBird's timestamps
 - get_location_codes(): (Work In Progress) Get the state and country location codes from Latitude & Longitude
+- count_detections_by_block(): Count species detections for each checklist time block in a single pass
+- roll_up_block_counts(): Build coarser checklist time block counts from finer grained block counts
+- get_code_lookup(): Get a state/country code lookup from a precompiled shape bundle, or the shapefile
 
 Example usage:
     from lib import cli_support
@@ -26,10 +29,14 @@ You may not:
 
 All rights are reserved by the author.
 """
+import bisect
+import logging
 import math
+import os
 import random
 import string
 import sys
+from collections import Counter
 from datetime import datetime, timedelta
 from typing import Tuple
 
@@ -37,6 +44,7 @@ import fiona
 from shapely.geometry import Point, shape
 
 from conf import config
+from lib import shape_bundle
 
 def generate_random_string(length=6):
     """
@@ -65,6 +73,20 @@ def generate_filename(base_name, date_str):
     random_str = generate_random_string()
     return f"{base_name}-{date_formatted}-{random_str}.csv"
 
+def add_filename_suffix(filepath, suffix):
+    """
+    Inserts a suffix into a file path, ahead of the file extension.
+
+    Args:
+        filepath (str): File path to add the suffix to (e.g., 'out/ebird_upload.csv').
+        suffix (str): Suffix to insert (e.g., '-1h').
+
+    Returns:
+        str: File path with the suffix inserted (e.g., 'out/ebird_upload-1h.csv').
+    """
+    root, extension = os.path.splitext(filepath)
+    return f"{root}{suffix}{extension}"
+
 def parse_timestamp(ts):
     """
     Parses the input timestamp and splits it into a date and time tuple
@@ -175,6 +197,77 @@ def split_time_range(start: datetime, end: datetime, interval: timedelta):
 
     return blocks
 
+def count_detections_by_block(detections, blocks):
+    """
+    Counts the detections of each species that fall within each time block. A detection is counted
+    in a block if start <= detection <= end, so a detection that lands exactly on the boundary shared
+    by two neighbouring blocks is counted in both of them.
+
+    Args:
+        detections (List[Tuple[datetime, Tuple[str, str]]]): (detection time, (common name, scientific name))
+            tuples, sorted by detection time
+        blocks (List[Tuple[datetime, datetime]]): List of block (start, end) times, as returned by
+            split_time_range()
+
+    Returns:
+        Tuple containing (block_counts, block_end_counts), both lists with one Counter per block. block_counts
+        holds the species counts for the whole block, block_end_counts holds only the species counts of the
+        detections made exactly at the block's end time, which is needed by roll_up_block_counts()
+    """
+    detection_times = [detection_time for detection_time, _ in detections]
+    block_counts = []
+    block_end_counts = []
+    for block_start, block_end in blocks:
+        first = bisect.bisect_left(detection_times, block_start)
+        last = bisect.bisect_right(detection_times, block_end)
+        block_counts.append(Counter(species for _, species in detections[first:last]))
+        end_first = bisect.bisect_left(detection_times, block_end, lo=first, hi=last)
+        block_end_counts.append(Counter(species for _, species in detections[end_first:last]))
+    return block_counts, block_end_counts
+
+def roll_up_block_counts(fine_blocks, fine_counts, fine_end_counts, coarse_blocks):
+    """
+    Builds the species counts of coarser time blocks by summing the counts of the finer blocks they
+    contain, without revisiting the detections. Detections on a boundary shared by two fine blocks
+    inside the same coarse block are only counted once, matching count_detections_by_block().
+
+    Both block lists must come from split_time_range() over the same time range, with the coarse
+    interval being a multiple of the fine interval, so that every coarse block starts and ends on
+    a fine block boundary (including the midnight truncation).
+
+    Args:
+        fine_blocks (List[Tuple[datetime, datetime]]): Fine grained block (start, end) times
+        fine_counts (List[Counter]): Species counts per fine block, from count_detections_by_block()
+        fine_end_counts (List[Counter]): Species counts at each fine block's end time, from
+            count_detections_by_block()
+        coarse_blocks (List[Tuple[datetime, datetime]]): Coarse block (start, end) times
+
+    Returns:
+        List[Counter]: Species counts per coarse block
+
+    Raises:
+        ValueError: If a coarse block boundary does not line up with a fine block boundary
+    """
+    fine_block_index = {block_start: index for index, (block_start, _) in enumerate(fine_blocks)}
+    coarse_counts = []
+    for coarse_start, coarse_end in coarse_blocks:
+        index = fine_block_index.get(coarse_start)
+        if index is None:
+            raise ValueError(f"Time block starting at {coarse_start} does not line up with the finer time blocks")
+        counts = Counter()
+        while True:
+            counts.update(fine_counts[index])
+            if fine_blocks[index][1] == coarse_end:
+                break
+            if fine_blocks[index][1] > coarse_end or index + 1 == len(fine_blocks):
+                raise ValueError(f"Time block ending at {coarse_end} does not line up with the finer time blocks")
+            # Remove detections that were counted in both of two neighbouring fine blocks
+            if fine_blocks[index + 1][0] == fine_blocks[index][1]:
+                counts.subtract(fine_end_counts[index])
+            index += 1
+        coarse_counts.append(+counts)
+    return coarse_counts
+
 def format_time_block(block: Tuple[datetime, datetime]) -> str:
     """
     Formats a (start, end) datetime tuple into a string of the form:
@@ -313,10 +406,53 @@ def set_station_details(logger, args, row):
 
     return station_details
 
-# Load shapes once to improve performance for repeat lookups
-country_shapes = load_shapes(config.country_shape_file, 'ISO_A2')
-state_shapes = load_shapes(config.state_shape_file, 'STUSPS')
+def get_code_lookup(bundle_path, filepath, code_field):
+    """
+    Returns an optimized lookup function for the codes of a shapefile, using its precompiled shape bundle if
+    one exists and was built from the current shapefile. A simplified bundle is only used for points within
+    the areas it was verified in, the full shapefile is loaded for lookups outside of them.
+
+    Args:
+        bundle_path (str): Path to the shape bundle, may be empty if no bundle is configured
+        filepath (str): Path to the shapefile (.shp)
+        code_field (str): Name of the attribute field that contains the desired code (ISO country code or state code)
+
+    Returns:
+        Callable[[float, float], Optional[str]]: A function that takes (lat, lon) and returns the matching code,
+        or None if no match is found
+    """
+    logger = logging.getLogger(config.tool_name)
+    if not (bundle_path and os.path.exists(bundle_path)):
+        return get_optimized_code_lookup(load_shapes(filepath, code_field))
+    if not shape_bundle.is_bundle_current(bundle_path, filepath, code_field, config.shape_bundle_tolerance):
+        logger.warning(f'Shape bundle {bundle_path} was not built from the current {filepath} and settings, '
+                       'loading the shapefile instead. Rebuild the bundle with --build_shape_bundles')
+        return get_optimized_code_lookup(load_shapes(filepath, code_field))
+
+    shapes, metadata = shape_bundle.load_bundle(bundle_path)
+    bundle_lookup = get_optimized_code_lookup(shapes)
+    verified_areas = shape_bundle.get_verified_areas(metadata)
+    if verified_areas is None:
+        return bundle_lookup
+
+    full_lookup = None
+
+    def find_code(lat, lon):
+        nonlocal full_lookup
+        point = Point(float(lon), float(lat))
+        if any(area.covers(point) for area in verified_areas):
+            return bundle_lookup(lat, lon)
+
+        # The simplified shapes were not verified here, so fall back to the full shapefile
+        if full_lookup is None:
+            logger.warning(f'Location ({lat}, {lon}) is outside of the station areas shape bundle {bundle_path} '
+                           f'was verified for, loading {filepath} instead. Rebuild the bundle with '
+                           '--build_shape_bundles using an input file from this station')
+            full_lookup = get_optimized_code_lookup(load_shapes(filepath, code_field))
+        return full_lookup(lat, lon)
+
+    return find_code
 
-# Create optimized lookup functions once to improve performance
-country_lookup = get_optimized_code_lookup(country_shapes)
-state_lookup = get_optimized_code_lookup(state_shapes)
\ No newline at end of file
+# Create optimized lookup functions once to improve performance for repeat lookups
+country_lookup = get_code_lookup(config.country_shape_bundle, config.country_shape_file, 'ISO_A2')
+state_lookup = get_code_lookup(config.state_shape_bundle, config.state_shape_file, 'STUSPS')
@@ -0,0 +1,326 @@
+"""
+output_support.py
+
+This library provides functions for writing the output .csv files of BirdWeather2eBird,
+splitting them into numbered shards when the output would be too large for eBird's import.
+
+Each shard is a valid standalone eBird file. Record Format output is split by row count and/or
+byte size as it is streamed, Checklist Format output is split by checklist (column) count and/or
+byte size, with every shard getting the complete header rows.
+
+It includes functions to:
+- get_shard_filename(): Get the file path of a numbered output shard
+- write_shard_list(): Record the shards written for an output file, so a later run can remove them
+- remove_shards(): Remove the numbered shards left by a previous run for an output file
+- remove_previous_output(): Remove the output left by a previous run for an output file
+- remove_file(): Remove a file, even if it is read-only
+- open_output_file(): Open an output file for writing, without modifying other hard links to it
+- ShardedCsvWriter: A csv writer that rolls over to a new shard when a limit would be exceeded
+- plan_checklist_shards(): Split the checklist columns of a Checklist Format grid into shards
+- write_checklist(): Write a Checklist Format grid, split into shards if needed
+
+Example usage:
+    from lib import output_support
+
+Author: Spike Graham
+Copyright (c) 2025 Spike Graham
+All rights reserved.
+
+This software is provided for personal, non-commercial use only.  
+You may view and run this software for personal educational or non-profit purposes.
+
+You may not:
+- Use this software in any commercial or enterprise context.
+- Distribute modified or unmodified versions.
+- Sell or include this software as part of a paid or monetized service or product.
+- Use this software in any for-profit capacity.
+
+All rights are reserved by the author.
+"""
+import csv
+import io
+import json
+import os
+import stat
+
+from lib import core_processing
+
+# Number of leading columns in each Checklist Format row that hold the row labels, rather than a checklist
+CHECKLIST_LABEL_COLUMNS = 2
+
+def get_shard_filename(output_file, shard_number):
+    """
+    Gets the file path of a numbered output shard
+
+    Args:
+        output_file (str): Output file path (e.g., 'ebird_upload.csv')
+        shard_number (int): Shard number, starting at 1
+
+    Returns:
+        str: Shard file path (e.g., 'ebird_upload-001.csv')
+    """
+    return core_processing.add_filename_suffix(output_file, f"-{shard_number:03d}")
+
+def get_shard_list_filename(output_file):
+    """
+    Gets the file path of the shard list recording the shards written for an output file
+
+    Args:
+        output_file (str): Output file path (e.g., 'ebird_upload.csv')
+
+    Returns:
+        str: Shard list file path (e.g., 'ebird_upload.csv.shards')
+    """
+    return f"{output_file}.shards"
+
+def write_shard_list(output_file, shard_files):
+    """
+    Records the shards written for an output file in a shard list next to it, so that a later run
+    only removes shards it can prove were written for the same output file
+
+    Args:
+        output_file (str): Output file path (e.g., 'ebird_upload.csv')
+        shard_files (List[str]): Paths of the shards written for the output file
+
+    Returns:
+        None
+    """
+    shard_list_file = get_shard_list_filename(output_file)
+    with open(f"{shard_list_file}.tmp", "w", encoding="utf-8") as outfile:
+        json.dump([os.path.basename(shard_file) for shard_file in shard_files], outfile)
+    os.replace(f"{shard_list_file}.tmp", shard_list_file)
+
+def remove_shards(output_file):
+    """
+    Removes the numbered shards of an output file recorded in its shard list, i.e. left by a previous run
+    that wrote more shards, so that stale shards are not uploaded along with the new ones. Files that
+    are not in the shard list are never removed.
+
+    Args:
+        output_file (str): Output file path (e.g., 'ebird_upload.csv')
+
+    Returns:
+        None
+    """
+    shard_list_file = get_shard_list_filename(output_file)
+    if not os.path.exists(shard_list_file):
+        return
+    with open(shard_list_file, encoding="utf-8") as infile:
+        shard_names = json.load(infile)
+    output_dir = os.path.dirname(output_file)
+    for shard_name in shard_names:
+        shard_file = os.path.join(output_dir, shard_name)
+        if os.path.exists(shard_file):
+            remove_file(shard_file)
+    os.remove(shard_list_file)
+
+def remove_previous_output(output_file, sharded):
+    """
+    Removes the output left by a previous run for an output file, being its recorded shards, and also
+    the output file itself when the new output is split into shards
+
+    Args:
+        output_file (str): Output file path (e.g., 'ebird_upload.csv')
+        sharded (bool): Whether the new output is split into numbered shards
+
+    Returns:
+        None
+    """
+    remove_shards(output_file)
+    if sharded and os.path.exists(output_file):
+        remove_file(output_file)
+
+def remove_file(path):
+    """
+    Removes a file, even if it is read-only (which os.remove refuses on Windows)
+
+    Args:
+        path (str): File path
+
+    Returns:
+        None
+    """
+    try:
+        os.remove(path)
+    except PermissionError:
+        os.chmod(path, stat.S_IREAD | stat.S_IWRITE)
+        os.remove(path)
+
+def open_output_file(path):
+    """
+    Opens an output file for writing. Any existing file is replaced rather than truncated, so that
+    other hard links to it (i.e. from the conversion cache) keep their content.
+
+    Args:
+        path (str): Output file path
+
+    Returns:
+        The opened file object
+    """
+    if os.path.exists(path):
+        remove_file(path)
+    return open(path, "w", newline="", encoding="utf-8")
+
+def render_row(row):
+    """
+    Renders a row exactly as csv.writer writes it to the output files
+
+    Args:
+        row (list): Row to render
+
+    Returns:
+        str: The rendered row, including its line terminator
+    """
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerow(row)
+    return buffer.getvalue()
+
+def get_field_size(value):
+    """
+    Gets the size in bytes of a single field as written by csv.writer, excluding any delimiter
+
+    Args:
+        value: Field value
+
+    Returns:
+        int: Size of the rendered field, in bytes
+    """
+    # A row with a single empty field is rendered as "", so a second field is added and then excluded
+    return len(render_row([value, ""]).encode("utf-8")) - len(",\n")
+
+class ShardedCsvWriter:
+    """
+    A csv writer that streams rows into numbered shards of the output file, starting a new shard
+    whenever writing a row would exceed max_rows or max_bytes. When no limits are set, rows are
+    written to the output file itself. A single row larger than max_bytes is written to its own shard.
+    Any output left by a previous run for the same output file is removed first, and the shard list
+    is updated as each shard is started.
+    """
+    def __init__(self, output_file, max_rows=None, max_bytes=None):
+        self.output_file = output_file
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.output_files = []
+        self.outfile = None
+        self.shard_rows = 0
+        self.shard_bytes = 0
+        remove_previous_output(output_file, bool(max_rows or max_bytes))
+        self.start_shard()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def start_shard(self):
+        """
+        Closes the current shard, if any, and opens the next one
+        """
+        self.close()
+        if self.max_rows or self.max_bytes:
+            shard_file = get_shard_filename(self.output_file, len(self.output_files) + 1)
+            write_shard_list(self.output_file, [*self.output_files, shard_file])
+        else:
+            shard_file = self.output_file
+        self.outfile = open_output_file(shard_file)
+        self.output_files.append(shard_file)
+        self.shard_rows = 0
+        self.shard_bytes = 0
+
+    def writerow(self, row):
+        """
+        Writes a row to the current shard, starting a new shard first if the row would exceed a limit
+
+        Args:
+            row (list): Row to write
+        """
+        rendered_row = render_row(row)
+        row_bytes = len(rendered_row.encode("utf-8"))
+        if self.shard_rows and (
+            (self.max_rows and self.shard_rows + 1 > self.max_rows) or
+            (self.max_bytes and self.shard_bytes + row_bytes > self.max_bytes)):
+            self.start_shard()
+        self.outfile.write(rendered_row)
+        self.shard_rows += 1
+        self.shard_bytes += row_bytes
+
+    def close(self):
+        """
+        Closes the current shard
+        """
+        if self.outfile is not None:
+            self.outfile.close()
+            self.outfile = None
+
+def plan_checklist_shards(rows, max_checklists=None, max_bytes=None):
+    """
+    Splits the checklist columns of a Checklist Format grid into shards, so that each shard has at most
+    max_checklists checklists and its file, including the label columns, is at most max_bytes. A single
+    checklist larger than max_bytes is put in its own shard.
+
+    Args:
+        rows (List[list]): Checklist Format rows, each starting with its label columns
+        max_checklists (int): Maximum number of checklists per shard, or None for no limit
+        max_bytes (int): Maximum size of each shard file in bytes, or None for no limit
+
+    Returns:
+        List[Tuple[int, int]]: (start, end) column ranges of the checklists in each shard, as slice indexes
+    """
+    checklist_count = len(rows[0]) - CHECKLIST_LABEL_COLUMNS
+    label_bytes = 0
+    if max_bytes:
+        label_bytes = sum(len(render_row(row[:CHECKLIST_LABEL_COLUMNS]).encode("utf-8")) for row in rows)
+
+    shards = []
+    shard_start = CHECKLIST_LABEL_COLUMNS
+    shard_bytes = label_bytes
+    for column in range(CHECKLIST_LABEL_COLUMNS, CHECKLIST_LABEL_COLUMNS + checklist_count):
+        column_bytes = 0
+        if max_bytes:
+            # Each checklist adds a delimiter and its field to every row
+            column_bytes = sum(1 + get_field_size(row[column]) for row in rows)
+        if column > shard_start and (
+            (max_checklists and column - shard_start + 1 > max_checklists) or
+            (max_bytes and shard_bytes + column_bytes > max_bytes)):
+            shards.append((shard_start, column))
+            shard_start = column
+            shard_bytes = label_bytes
+        shard_bytes += column_bytes
+    shards.append((shard_start, CHECKLIST_LABEL_COLUMNS + checklist_count))
+    return shards
+
+def write_checklist(output_file, rows, max_checklists=None, max_bytes=None):
+    """
+    Writes a Checklist Format grid to the output file, or to numbered shards of it if a limit is set.
+    Any output left by a previous run for the same output file is removed first, and the shards written
+    are recorded in the shard list.
+
+    Args:
+        output_file (str): Output file path
+        rows (List[list]): Checklist Format rows, each starting with its label columns
+        max_checklists (int): Maximum number of checklists per shard, or None for no limit
+        max_bytes (int): Maximum size of each shard file in bytes, or None for no limit
+
+    Returns:
+        List[str]: Paths of the files written
+    """
+    if not (max_checklists or max_bytes):
+        shards = [(CHECKLIST_LABEL_COLUMNS, len(rows[0]))]
+    else:
+        shards = plan_checklist_shards(rows, max_checklists, max_bytes)
+
+    remove_previous_output(output_file, bool(max_checklists or max_bytes))
+    if max_checklists or max_bytes:
+        shard_files = [get_shard_filename(output_file, shard_number) for shard_number in range(1, len(shards) + 1)]
+        write_shard_list(output_file, shard_files)
+    else:
+        shard_files = [output_file]
+    output_files = []
+    for shard_file, (shard_start, shard_end) in zip(shard_files, shards):
+        with open_output_file(shard_file) as outfile:
+            writer = csv.writer(outfile, lineterminator="\n")
+            for row in rows:
+                writer.writerow([*row[:CHECKLIST_LABEL_COLUMNS], *row[shard_start:shard_end]])
+        output_files.append(shard_file)
+    return output_files
@@ -0,0 +1,286 @@
+"""
+shape_bundle.py
+
+This library provides functions for building and loading precompiled shape bundles, a compact
+alternative to the full-resolution shapefiles used for state and country code lookups.
+
+A shape bundle stores each geometry as WKB along with its bounding box and code. The bounding
+boxes are read up front, while the WKB is only parsed into a geometry the first time a lookup
+point falls inside its bounding box, which makes loading a bundle much faster than parsing the
+shapefile it was built from.
+
+It includes functions to:
+- get_check_areas(): Build the areas around station locations used to verify a simplified shape bundle
+- simplify_shapes(): Simplify shapes, without changing the codes found within the check areas
+- build_bundle(): Build a shape bundle file from a list of (geometry, code) shapes
+- read_bundle_metadata(): Read the metadata recorded in a shape bundle's header
+- is_bundle_current(): Check if a shape bundle was built from the current version of its shapefile
+- get_verified_areas(): Get the areas a simplified shape bundle was verified in
+- load_bundle(): Load a shape bundle file, by memory-mapping it
+
+Example usage:
+    from lib import shape_bundle
+
+Author: Spike Graham
+Copyright (c) 2025 Spike Graham
+All rights reserved.
+
+This software is provided for personal, non-commercial use only.  
+You may view and run this software for personal educational or non-profit purposes.
+
+You may not:
+- Use this software in any commercial or enterprise context.
+- Distribute modified or unmodified versions.
+- Sell or include this software as part of a paid or monetized service or product.
+- Use this software in any for-profit capacity.
+
+All rights are reserved by the author.
+"""
+import json
+import mmap
+import os
+import struct
+
+import shapely
+from shapely import wkb
+from shapely.geometry import Point
+
+BUNDLE_MAGIC = b"BW2EGEO\x03"
+# Bundle header: magic, length of the JSON metadata that follows it. The metadata records the source shapefile
+# signature, code field, simplification tolerance and the station locations the simplification was verified for.
+HEADER_FORMAT = struct.Struct("<8sI")
+# Index entry: minx, miny, maxx, maxy, WKB offset, WKB length, code length. The code bytes follow each entry.
+INDEX_ENTRY_FORMAT = struct.Struct("<4dQIH")
+
+class BundledGeometry:
+    """
+    A geometry stored in a memory-mapped shape bundle, which is only parsed from its WKB the first
+    time a point within its bounding box is checked. Supports the contains() checks used by
+    core_processing.get_optimized_code_lookup().
+    """
+    def __init__(self, buffer, offset, length, bounds):
+        self.buffer = buffer
+        self.offset = offset
+        self.length = length
+        self.bounds = bounds
+        self.geometry = None
+
+    def __bool__(self):
+        return True
+
+    def contains(self, point):
+        """
+        Checks if the point is within the geometry, checking the bounding box before parsing the geometry
+
+        Args:
+            point (Point): Point to check
+
+        Returns:
+            bool: True if the point is within the geometry
+        """
+        minx, miny, maxx, maxy = self.bounds
+        if not (minx <= point.x <= maxx and miny <= point.y <= maxy):
+            return False
+        if self.geometry is None:
+            self.geometry = wkb.loads(bytes(self.buffer[self.offset:self.offset + self.length]))
+            shapely.prepare(self.geometry)
+        return self.geometry.contains(point)
+
+def get_check_areas(locations, radius):
+    """
+    Builds the areas used to verify a simplified bundle, being a circle of the given radius around each location
+
+    Args:
+        locations (Iterable[Tuple[float, float]]): (latitude, longitude) locations to check, i.e. station locations
+        radius (float): Radius in degrees around each location to check, 0 only checks the location itself
+
+    Returns:
+        List[Polygon]: Areas to check, in (lon, lat) order
+    """
+    areas = []
+    for lat, lon in locations:
+        point = Point(float(lon), float(lat))
+        areas.append(point.buffer(radius) if radius else point)
+    return areas
+
+def simplify_shapes(shapes, tolerance, check_areas):
+    """
+    Simplifies each shape's geometry, keeping the full-resolution geometry for any shape where
+    simplifying it would change any part of it within one of the check areas. This ensures codes
+    looked up anywhere within the check areas are the same as with the full-resolution shapes.
+
+    Args:
+        shapes (List[Tuple[Polygon, str]]): A list of tuples containing geometries and their associated codes
+        tolerance (float): Simplification tolerance, in degrees
+        check_areas (List[Polygon]): Areas that must keep the same codes, from get_check_areas()
+
+    Returns:
+        Tuple containing (shapes, kept_count), where shapes is the list of simplified (geometry, code) tuples and
+        kept_count is the number of shapes that were kept at full resolution
+    """
+    simplified = []
+    kept_count = 0
+    for geom, code in shapes:
+        simplified_geom = geom.simplify(tolerance, preserve_topology=True)
+        changed_area = geom.symmetric_difference(simplified_geom)
+        if any(changed_area.intersects(area) for area in check_areas):
+            simplified.append((geom, code))
+            kept_count += 1
+        else:
+            simplified.append((simplified_geom, code))
+    return simplified, kept_count
+
+def get_source_signature(source_file):
+    """
+    Gets the modification time and size of a shapefile's geometry (.shp) and attribute (.dbf) files, used to
+    detect bundles built from an older version of them
+
+    Args:
+        source_file (str): Path to the shapefile (.shp)
+
+    Returns:
+        dict: {"shp": [modification time in ns, size in bytes], "dbf": [...]}, with None for missing files
+    """
+    signature = {}
+    for extension in ["shp", "dbf"]:
+        path = f"{os.path.splitext(source_file)[0]}.{extension}"
+        if os.path.exists(path):
+            stat_result = os.stat(path)
+            signature[extension] = [stat_result.st_mtime_ns, stat_result.st_size]
+        else:
+            signature[extension] = None
+    return signature
+
+def build_bundle(shapes, bundle_path, source_file, code_field, tolerance, checked_locations, check_radius):
+    """
+    Writes shapes to a shape bundle file
+
+    Args:
+        shapes (List[Tuple[Polygon, str]]): A list of tuples containing geometries and their associated codes
+        bundle_path (str): Path to write the shape bundle to
+        source_file (str): Path to the shapefile (.shp) the shapes were loaded from
+        code_field (str): Name of the attribute field the codes were loaded from
+        tolerance (float): Simplification tolerance the shapes were simplified with, 0 if they were not
+        checked_locations (Iterable[Tuple[float, float]]): (latitude, longitude) locations the simplification was
+            verified around
+        check_radius (float): Radius in degrees around each checked location that was verified
+
+    Returns:
+        None
+    """
+    entries = []
+    geometries = []
+    wkb_offset = 0
+    for geom, code in shapes:
+        geom_wkb = wkb.dumps(geom)
+        code_bytes = (code or "").encode("utf-8")
+        entries.append(INDEX_ENTRY_FORMAT.pack(*geom.bounds, wkb_offset, len(geom_wkb), len(code_bytes))
+                       + code_bytes)
+        geometries.append(geom_wkb)
+        wkb_offset += len(geom_wkb)
+
+    metadata = json.dumps({
+        "sources": get_source_signature(source_file),
+        "code_field": code_field,
+        "tolerance": tolerance,
+        "checked_locations": [[float(lat), float(lon)] for lat, lon in checked_locations],
+        "check_radius": check_radius,
+        "shape_count": len(entries)
+    }).encode("utf-8")
+    with open(bundle_path, "wb") as bundle_file:
+        bundle_file.write(HEADER_FORMAT.pack(BUNDLE_MAGIC, len(metadata)))
+        bundle_file.write(metadata)
+        bundle_file.writelines(entries)
+        bundle_file.writelines(geometries)
+
+def read_bundle_metadata(bundle_path):
+    """
+    Reads the metadata from a shape bundle's header
+
+    Args:
+        bundle_path (str): Path to the shape bundle, as written by build_bundle()
+
+    Returns:
+        dict: The bundle metadata, or None if the file is not a shape bundle of this version
+    """
+    with open(bundle_path, "rb") as bundle_file:
+        header = bundle_file.read(HEADER_FORMAT.size)
+        if len(header) < HEADER_FORMAT.size:
+            return None
+        magic, metadata_length = HEADER_FORMAT.unpack(header)
+        if magic != BUNDLE_MAGIC:
+            return None
+        return json.loads(bundle_file.read(metadata_length).decode("utf-8"))
+
+def is_bundle_current(bundle_path, source_file, code_field, tolerance):
+    """
+    Checks if a shape bundle was built by this version of the tool, from the current version of its shapefile,
+    with the same code field and simplification tolerance
+
+    Args:
+        bundle_path (str): Path to the shape bundle, as written by build_bundle()
+        source_file (str): Path to the shapefile (.shp) the bundle should have been built from
+        code_field (str): Name of the attribute field the codes should have been loaded from
+        tolerance (float): Simplification tolerance the bundle should have been built with
+
+    Returns:
+        bool: True if the bundle can be used in place of the shapefile
+    """
+    metadata = read_bundle_metadata(bundle_path)
+    if metadata is None:
+        return False
+    return (metadata["sources"] == get_source_signature(source_file) and
+            metadata["code_field"] == code_field and
+            metadata["tolerance"] == tolerance)
+
+def get_verified_areas(metadata):
+    """
+    Gets the areas a shape bundle's codes were verified to match the shapefile in
+
+    Args:
+        metadata (dict): The bundle metadata, from read_bundle_metadata() or load_bundle()
+
+    Returns:
+        List[Polygon]: The verified areas, or None if the shapes were not simplified and match everywhere
+    """
+    if not metadata["tolerance"]:
+        return None
+    return get_check_areas(metadata["checked_locations"], metadata["check_radius"])
+
+def load_bundle(bundle_path):
+    """
+    Loads shapes from a shape bundle file. The file is memory-mapped, and each geometry is only
+    parsed once a lookup needs it.
+
+    Args:
+        bundle_path (str): Path to the shape bundle, as written by build_bundle()
+
+    Returns:
+        Tuple containing (shapes, metadata), where shapes is a list of (geometry, code) tuples with geometry being a
+        BundledGeometry, and metadata is the bundle metadata
+
+    Raises:
+        ValueError: If the file is not a shape bundle
+    """
+    with open(bundle_path, "rb") as bundle_file:
+        buffer = mmap.mmap(bundle_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, metadata_length = HEADER_FORMAT.unpack_from(buffer, 0)
+    if magic != BUNDLE_MAGIC:
+        raise ValueError(f"{bundle_path} is not a shape bundle")
+    position = HEADER_FORMAT.size
+    metadata = json.loads(buffer[position:position + metadata_length].decode("utf-8"))
+    position += metadata_length
+
+    index = []
+    for _ in range(metadata["shape_count"]):
+        minx, miny, maxx, maxy, wkb_offset, wkb_length, code_length = INDEX_ENTRY_FORMAT.unpack_from(buffer, position)
+        position += INDEX_ENTRY_FORMAT.size
+        code = buffer[position:position + code_length].decode("utf-8")
+        position += code_length
+        index.append(((minx, miny, maxx, maxy), wkb_offset, wkb_length, code))
+
+    # The WKB section starts right after the index
+    shapes = [(BundledGeometry(buffer, position + wkb_offset, wkb_length, bounds), code)
+              for bounds, wkb_offset, wkb_length, code in index]
+    return shapes, metadata
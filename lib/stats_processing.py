@@ -0,0 +1,181 @@
+"""
+stats_processing.py
+
+This library provides functions for building, writing and merging the detection stats
+of BirdWeather2eBird runs.
+
+The stats are summarized as JSON, with per species totals, hour of day counts and date counts,
+so that the summaries of many runs can be merged without re-reading their input files.
+
+It includes functions to:
+- get_source_id(): Get the identifier of the input counted by a stats summary
+- build_summary(): Build a JSON serializable stats summary from the counts of a run
+- merge_summaries(): Merge several stats summaries into one, counting each input once
+- read_summary(): Read a stats summary from a .json file
+- write_summary(): Write a stats summary to a .json file
+- log_summary(): Output a stats summary to the logger
+
+Example usage:
+    from lib import stats_processing
+
+Author: Spike Graham
+Copyright (c) 2025 Spike Graham
+All rights reserved.
+
+This software is provided for personal, non-commercial use only.  
+You may view and run this software for personal educational or non-profit purposes.
+
+You may not:
+- Use this software in any commercial or enterprise context.
+- Distribute modified or unmodified versions.
+- Sell or include this software as part of a paid or monetized service or product.
+- Use this software in any for-profit capacity.
+
+All rights are reserved by the author.
+"""
+import hashlib
+import json
+from collections import Counter
+
+def get_source_id(input_hash, filter_to_date):
+    """
+    Gets the identifier of the input counted by a stats summary. The counts only depend on the input file
+    content and the date filter, so runs converting the same input with other options share the same source.
+
+    Args:
+        input_hash (str): Hash of the input file content, from cache_support.get_input_hash()
+        filter_to_date (str): Date the input was filtered to, or None
+
+    Returns:
+        str: Hex digest identifying the counted input
+    """
+    return hashlib.sha256(f"{input_hash}:{filter_to_date or ''}".encode("utf-8")).hexdigest()
+
+def build_summary(total_detections, species_counts, species_hour_counts, species_date_counts, sources=()):
+    """
+    Builds a JSON serializable stats summary from the counts collected while processing a file
+
+    Args:
+        total_detections (int): Total count of all detections
+        species_counts (dict): Count per (common_name, scientific_name) species
+        species_hour_counts (Counter): Count per (species, hour of day) pair
+        species_date_counts (Counter): Count per (species, date) pair, with dates formatted as YYYY-MM-DD
+        sources (Iterable[str]): Identifiers of the counted inputs, from get_source_id()
+
+    Returns:
+        dict: The stats summary, in the form
+              {"runs": 1, "sources": [str], "total_detections": int, "species": [{"common_name": str,
+              "scientific_name": str, "total": int, "by_hour": [24 ints], "by_date": {"YYYY-MM-DD": int}}]}
+    """
+    species_summaries = {
+        species: {
+            "common_name": species[0],
+            "scientific_name": species[1],
+            "total": count,
+            "by_hour": [0] * 24,
+            "by_date": {}
+        } for species, count in species_counts.items()
+    }
+    for (species, hour), count in species_hour_counts.items():
+        species_summaries[species]["by_hour"][hour] += count
+    for (species, date), count in sorted(species_date_counts.items(), key=lambda item: item[0][1]):
+        species_summaries[species]["by_date"][date] = count
+    return {
+        "runs": 1,
+        "sources": sorted(sources),
+        "total_detections": total_detections,
+        "species": list(species_summaries.values())
+    }
+
+def merge_summaries(summaries):
+    """
+    Merges several stats summaries into one, adding up their counts. Each input is only counted once, so a
+    summary whose sources were all counted by an earlier summary (i.e. the same input converted again) is
+    skipped. Summaries without sources, written by older versions, are always counted.
+
+    Args:
+        summaries (Iterable[dict]): Stats summaries, as built by build_summary() or merge_summaries()
+
+    Returns:
+        dict: The merged stats summary
+
+    Raises:
+        ValueError: If a summary shares only some of its sources with earlier summaries, as its counts can't be
+            split by source
+    """
+    runs = 0
+    total_detections = 0
+    species_counts = {}
+    species_hour_counts = Counter()
+    species_date_counts = Counter()
+    sources = set()
+    for summary in summaries:
+        summary_sources = set(summary.get("sources", []))
+        if summary_sources and summary_sources <= sources:
+            continue
+        if summary_sources & sources:
+            raise ValueError("A stats summary partially overlaps the inputs of the other summaries, "
+                             "merge the original summaries instead")
+        sources |= summary_sources
+        runs += summary["runs"]
+        total_detections += summary["total_detections"]
+        for species_summary in summary["species"]:
+            species = (species_summary["common_name"], species_summary["scientific_name"])
+            species_counts[species] = species_counts.get(species, 0) + species_summary["total"]
+            for hour, count in enumerate(species_summary["by_hour"]):
+                if count:
+                    species_hour_counts[(species, hour)] += count
+            for date, count in species_summary["by_date"].items():
+                species_date_counts[(species, date)] += count
+    merged = build_summary(total_detections, species_counts, species_hour_counts, species_date_counts, sources)
+    merged["runs"] = runs
+    return merged
+
+def read_summary(filepath):
+    """
+    Reads a stats summary from a .json file
+
+    Args:
+        filepath (str): Path to the .json file
+
+    Returns:
+        dict: The stats summary
+    """
+    with open(filepath, encoding="utf-8") as infile:
+        return json.load(infile)
+
+def write_summary(summary, filepath):
+    """
+    Writes a stats summary to a .json file
+
+    Args:
+        summary (dict): The stats summary
+        filepath (str): Path to the .json file
+
+    Returns:
+        None
+    """
+    with open(filepath, "w", encoding="utf-8") as outfile:
+        json.dump(summary, outfile)
+
+def log_summary(logger, summary):
+    """
+    Outputs the totals and per species counts of a stats summary to the logger
+
+    Args:
+        logger (logging.Logger): Logger to output the stats to
+        summary (dict): The stats summary
+
+    Returns:
+        None
+    """
+    logger.info('')
+    logger.info('Processed File Stats')
+    logger.info(f'Total Detections: {summary["total_detections"]}')
+    logger.info(f'Total Species: {len(summary["species"])}')
+    logger.info('')
+    logger.info('Species Stats')
+    for species_summary in summary["species"]:
+        species = (species_summary["common_name"], species_summary["scientific_name"])
+        logger.info(f'{species}: {species_summary["total"]}')
+    logger.info('')